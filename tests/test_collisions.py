@@ -28,8 +28,8 @@ from vlapy.core import step
 import numpy as np
 
 
-ALL_SOLVERS = ["naive", "batched_tridiagonal"]
-ALL_SOLVERS_FOR_FAST_TESTING = ["batched_tridiagonal"]
+ALL_SOLVERS = ["naive", "batched_tridiagonal", "banded"]
+ALL_SOLVERS_FOR_FAST_TESTING = ["batched_tridiagonal", "banded"]
 ALL_OPERATORS = ["lb", "dg"]
 
 TOLERANCE = 4
@@ -63,3 +63,18 @@ def test_initial_temperature():
         np.ones(nx),
         decimal=3,
     )
+
+
+def test_initializers_are_cached_and_read_only():
+    f = initializers.initialize_distribution(nx=16, nv=64, vmax=6.0)
+    dx, x, kx, one_over_kx = initializers.initialize_spatial_quantities(
+        xmin=0.0, xmax=10.0, nx=16
+    )
+
+    assert f is initializers.initialize_distribution(nx=16, nv=64, vmax=6.0)
+    assert (
+        x is initializers.initialize_spatial_quantities(xmin=0.0, xmax=10.0, nx=16)[1]
+    )
+
+    for array in [f, x, kx, one_over_kx]:
+        assert not array.flags.writeable
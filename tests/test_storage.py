@@ -21,15 +21,22 @@
 # SOFTWARE.
 
 import os
+import shutil
+import subprocess
+import sys
 import tempfile
 
 import numpy as np
+import pytest
+import xarray as xr
 
 from vlapy import storage, outer_loop
 from tests import helpers
 
 
-def __initialize_base_storage_stuff__(td, xax, vax, rules_to_store_f=None):
+def __initialize_base_storage_stuff__(
+    td, xax, vax, rules_to_store_f=None, return_sim_config=False
+):
     if rules_to_store_f is None:
         rules_to_store_f = {"space": "all", "time": "all"}
 
@@ -69,20 +76,24 @@ def __initialize_base_storage_stuff__(td, xax, vax, rules_to_store_f=None):
 
     st.batch_update(sim_config=sim_config)
 
+    if return_sim_config:
+        return st, sim_config
+
     return st
 
 
-def test_storage_individual_file_creation():
+def test_storage_file_creation_on_batch_update():
     xax = np.linspace(0, 1, 16)
     vax = np.linspace(-6, 6, 24)
 
     with tempfile.TemporaryDirectory() as td:
         st = __initialize_base_storage_stuff__(td, xax, vax)
 
-        assert os.path.exists(os.path.join(st.paths["fields-individual"], "000.nc"))
+        assert os.path.exists(os.path.join(st.paths["fields"], "all-fields.nc"))
         assert os.path.exists(
-            os.path.join(st.paths["distribution-individual"], "000.nc")
+            os.path.join(st.paths["distribution"], "all-distribution.nc")
         )
+        st.close()
 
 
 def test_storage_total_file_creation():
@@ -135,3 +146,118 @@ def test_storage_init_shape_fourier():
         np.testing.assert_equal(
             st.dist_dataset["distribution_function"].coords["velocity"].size, vax.size
         )
+
+
+def test_storage_appends_batches():
+    xax = np.linspace(0, 1, 16)
+    vax = np.linspace(-6, 6, 24)
+
+    with tempfile.TemporaryDirectory() as td:
+        rules_to_store_f = {"space": ["k0", "k1"], "time": "first-last"}
+        st, sim_config = __initialize_base_storage_stuff__(
+            td, xax, vax, rules_to_store_f=rules_to_store_f, return_sim_config=True
+        )
+
+        for batch in range(1, 3):
+            sim_config["time_batch"] = sim_config["time_batch"] + 2
+            sim_config["fields"]["e"][:] = batch
+            st.batch_update(sim_config=sim_config)
+
+        st.load_data_over_all_timesteps()
+
+        np.testing.assert_equal(st.fields_dataset["e"].coords["time"].size, 6)
+        np.testing.assert_equal(st.fields_dataset["e"].data[-1], np.full(16, 2.0))
+        np.testing.assert_equal(
+            st.dist_dataset["distribution_function"].coords["time"].size, 4
+        )
+        st.unload_data_over_all_timesteps()
+        st.close()
+
+
+def test_chunk_shape_divides_batch():
+    np.testing.assert_equal(storage.get_chunk_shape((100, 32), 4), (100, 32))
+    np.testing.assert_equal(
+        storage.get_chunk_shape((1000, 512, 512), 4), (10, 512, 512)
+    )
+
+
+def test_storage_precision_of_fourier_modes():
+    xax = np.linspace(0, 1, 16)
+    vax = np.linspace(-6, 6, 24)
+
+    for precision, dtype in [("single", np.complex64), ("double", np.complex128)]:
+        with tempfile.TemporaryDirectory() as td:
+            rules_to_store_f = {
+                "space": ["k0", "k1"],
+                "time": "all",
+                "precision": precision,
+            }
+            st, sim_config = __initialize_base_storage_stuff__(
+                td, xax, vax, rules_to_store_f=rules_to_store_f, return_sim_config=True
+            )
+            np.testing.assert_equal(sim_config["stored_f"].dtype, dtype)
+
+            st.load_data_over_all_timesteps()
+            np.testing.assert_equal(
+                st.dist_dataset["distribution_function"].dtype, dtype
+            )
+            st.close()
+
+
+def test_storage_precision_defaults():
+    xax = np.linspace(0, 1, 16)
+    vax = np.linspace(-6, 6, 24)
+
+    for space, dtype in [("all", np.float64), (["k0", "k1"], np.complex64)]:
+        with tempfile.TemporaryDirectory() as td:
+            st, sim_config = __initialize_base_storage_stuff__(
+                td,
+                xax,
+                vax,
+                rules_to_store_f={"space": space, "time": "all"},
+                return_sim_config=True,
+            )
+            np.testing.assert_equal(sim_config["stored_f"].dtype, dtype)
+            st.close()
+
+
+def test_storage_closes_files_on_error():
+    xax = np.linspace(0, 1, 16)
+    vax = np.linspace(-6, 6, 24)
+
+    with tempfile.TemporaryDirectory() as td:
+        with pytest.raises(RuntimeError):
+            with __initialize_base_storage_stuff__(td, xax, vax) as st:
+                raise RuntimeError
+
+        # HDF5 hands back the already open file within the same process, so the files
+        # are reopened for writing from a separate process. This fails while they are still held
+        for file_name in st.file_names.values():
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    "import sys, h5py; h5py.File(sys.argv[1], 'r+').close()",
+                    file_name,
+                ],
+                check=True,
+            )
+            xr.open_dataset(file_name, engine="h5netcdf").close()
+
+
+def test_storage_files_are_readable_after_batch_update():
+    xax = np.linspace(0, 1, 16)
+    vax = np.linspace(-6, 6, 24)
+
+    with tempfile.TemporaryDirectory() as td:
+        rules_to_store_f = {"space": ["k0", "k1"], "time": "all"}
+        with __initialize_base_storage_stuff__(
+            td, xax, vax, rules_to_store_f=rules_to_store_f
+        ) as st:
+            # The copies are read through their own HDF5 handles, like an upload would be,
+            # while the files are still open for writing
+            for key, file_name in st.file_names.items():
+                copy_name = os.path.join(td, "copy-" + key + ".nc")
+                shutil.copy(file_name, copy_name)
+                with xr.open_dataset(copy_name, engine="h5netcdf") as ds:
+                    np.testing.assert_equal(ds.coords["time"].size > 0, True)
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 import numpy as np
+from scipy import linalg
 
 
 def get_philharmonic_matrix_maker(vax, nv, nx, nu, dt, dv):
@@ -265,6 +266,48 @@ def get_batched_tridiag_solver(nv):
     return _batched_tridiag_solver_
 
 
+def get_banded_solver(nx, nv):
+    """
+    This function returns the banded solver for the collision operator.
+
+    The tridiagonal systems for each x are independent, so they are stacked into a single tridiagonal
+    system of size `nx * nv` with zeros in the off-diagonals at the boundaries between x cells.
+    This is then solved using a single LAPACK call through SciPy's banded solver.
+
+    :param nx: (int) number of x cells
+    :param nv: (int) number of v cells
+    :return: new function with above arguments initialized as static variables
+    """
+
+    banded_matrix = np.zeros((3, nx * nv))
+    upper_diagonal = banded_matrix[0].reshape((nx, nv))
+    diagonal = banded_matrix[1].reshape((nx, nv))
+    lower_diagonal = banded_matrix[2].reshape((nx, nv))
+
+    def _banded_solver_(a, b, c, f):
+        """
+        Solves all the `Af_p = f` systems in one banded solve
+
+        :param a: (2D float array (nx, nv-1)) the sub-diagonal of the matrix for each x cell
+        :param b: (2D float array (nx, nv)) the diagonal of the matrix
+        :param c: (2D float array (nx, nv-1)) the super-diagonal of the matrix
+        :param f: (2D float array (nx, nv)) the RHS of the `Af_p = f` system.
+        :return: the solution, `x`, of the `Af_p = b` system
+        """
+
+        # The first and last entries of each x cell in the off-diagonals stay zero
+        # so that the x cells remain decoupled
+        upper_diagonal[:, 1:] = c
+        diagonal[:] = b
+        lower_diagonal[:, :-1] = a
+
+        return linalg.solve_banded(
+            (1, 1), banded_matrix, f.reshape(nx * nv), check_finite=False
+        ).reshape((nx, nv))
+
+    return _banded_solver_
+
+
 def get_matrix_solver(nx, nv, solver_name="batched_tridiagonal"):
     """
     This method gets the right solver based on the choice in the input parameters
@@ -279,6 +322,8 @@ def get_matrix_solver(nx, nv, solver_name="batched_tridiagonal"):
         matrix_solver = get_naive_solver(nx)
     elif solver_name == "batched_tridiagonal":
         matrix_solver = get_batched_tridiag_solver(nv)
+    elif solver_name == "banded":
+        matrix_solver = get_banded_solver(nx, nv)
     else:
         raise NotImplementedError(
             "Matrix Solver: <"
@@ -46,7 +46,13 @@ def __fft_solve__(net_charge_density, one_over_kx):
     :return:
     """
 
-    return np.real(fft.ifft(1j * one_over_kx * fft.fft(net_charge_density)))
+    # The charge density is real so the real-to-complex transforms are used.
+    # Only the non-negative wavenumbers are needed for those
+    one_over_kx_r = one_over_kx[: one_over_kx.size // 2 + 1]
+
+    return fft.irfft(
+        1j * one_over_kx_r * fft.rfft(net_charge_density), n=net_charge_density.size
+    )
 
 
 def solve_for_field(charge_density, one_over_kx):
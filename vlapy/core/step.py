@@ -21,7 +21,6 @@
 # SOFTWARE.
 
 import numpy as np
-from scipy import fft
 
 from vlapy.core import field, vlasov, collisions, vlasov_poisson
 
@@ -113,31 +112,40 @@ def get_collision_step(stuff_for_time_loop, all_params):
     return take_collision_step
 
 
-def get_f_update(store_f_rule):
+def get_f_update(store_f_rule, nx):
     """
     This function returns the function used in the stepper for storing f in a batch
     It performs the necessary transformations if we're just storing Fourier modes.
 
     :param store_f_rule: (dictionary) the rules to store the distribution function as
      dictated by the diagnostics routine for the simulation
-    :return:
+    :param nx: (int) the size of the grid in x
+    :return: function that writes the quantity to be stored into the provided slot of the batch
     """
     if store_f_rule["space"] == "all":
 
-        def get_f_to_store(f):
-            return f
+        def store_f(f, out):
+            np.copyto(out, f)
 
     elif store_f_rule["space"][0] == "k0":
+        num_modes = len(store_f_rule["space"])
+
+        # Only the first few modes are stored so, instead of an FFT over all of them,
+        # the DFT is performed for just those modes as two real matrix products
+        phase = (
+            2.0 * np.pi * np.arange(num_modes)[:, None] * np.arange(nx)[None, :] / nx
+        )
+        dft_real = np.cos(phase)
+        dft_imag = -np.sin(phase)
 
-        def get_f_to_store(f):
-            return fft.fft(f, axis=0)[
-                : len(store_f_rule),
-            ]
+        def store_f(f, out):
+            np.matmul(dft_real, f, out=out.real)
+            np.matmul(dft_imag, f, out=out.imag)
 
     else:
         raise NotImplementedError
 
-    return get_f_to_store
+    return store_f
 
 
 def get_fields_update(dv, v):
@@ -149,6 +157,15 @@ def get_fields_update(dv, v):
     :param v: (1D float array) the velocity-grid
     :return: function with the above values initialized as static variables
     """
+    moment_names = ["n", "j", "T", "q", "fv4", "vN"]
+
+    # Each column holds the trapezoidal-rule weights times v^p, for the p-th moment,
+    # so that all the moments come from one matrix product
+    trapezoid_weights = np.full(v.size, dv)
+    trapezoid_weights[[0, -1]] = 0.5 * dv
+    moment_weights = trapezoid_weights[:, None] * v[:, None] ** np.arange(
+        len(moment_names)
+    )
 
     def update_fields(temp_storage_fields, e, de, f, i):
         """
@@ -163,12 +180,10 @@ def get_fields_update(dv, v):
         """
         temp_storage_fields["e"][i] = e
         temp_storage_fields["driver"][i] = de
-        temp_storage_fields["n"][i] = np.trapz(f, dx=dv, axis=1)
-        temp_storage_fields["j"][i] = np.trapz(f * v, dx=dv, axis=1)
-        temp_storage_fields["T"][i] = np.trapz(f * v ** 2, dx=dv, axis=1)
-        temp_storage_fields["q"][i] = np.trapz(f * v ** 3, dx=dv, axis=1)
-        temp_storage_fields["fv4"][i] = np.trapz(f * v ** 4, dx=dv, axis=1)
-        temp_storage_fields["vN"][i] = np.trapz(f * v ** 5, dx=dv, axis=1)
+
+        moments = f @ moment_weights
+        for moment_index, name in enumerate(moment_names):
+            temp_storage_fields[name][i] = moments[:, moment_index]
 
         return temp_storage_fields
 
@@ -244,7 +259,8 @@ def get_storage_step(stuff_for_time_loop):
     v = stuff_for_time_loop["v"]
 
     store_f_function = get_f_update(
-        store_f_rule=stuff_for_time_loop["rules_to_store_f"]
+        store_f_rule=stuff_for_time_loop["rules_to_store_f"],
+        nx=stuff_for_time_loop["nx"],
     )
 
     update_fields = get_fields_update(dv=dv, v=v)
@@ -266,7 +282,8 @@ def get_storage_step(stuff_for_time_loop):
         :param i: (int) Loop index for storage
         :return: (dictionary) updated dictionary for this timestep
         """
-        temp_storage["stored_f"][i] = store_f_function(f)
+        # Write into the buffer that is allocated once for the batch
+        store_f_function(f, out=temp_storage["stored_f"][i])
 
         temp_storage["e"] = e
         temp_storage["f"] = f
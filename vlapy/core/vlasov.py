@@ -80,7 +80,7 @@ def get_vdfdx_sl(x, v):
     return update_spatial_adv_sl
 
 
-def get_vdfdx_exponential(kx, v):
+def get_vdfdx_exponential(kx, v, fft_workers=1):
     """
     This function creates the exponential v df/dx stepper
 
@@ -88,9 +88,13 @@ def get_vdfdx_exponential(kx, v):
 
     :param kx: (float array (nx, )) the real-space wavenumber
     :param v: (float array  (nv, )) the velocity grid
+    :param fft_workers: (int) the number of threads used by the FFTs. -1 uses all the cores
     :return: a function with the above values initialized as static variables
     """
 
+    # f is real so only the non-negative wavenumbers are needed for the real-to-complex transforms
+    kx_r = kx[: kx.size // 2 + 1]
+
     def step_vdfdx_exponential(f, dt):
         """
         evolution of df/dt = v df/dx using the exponential integrator described in
@@ -103,23 +107,31 @@ def get_vdfdx_exponential(kx, v):
         :return: (float array (nx, nv)) updated distribution function
         """
 
-        return np.real(
-            fft.ifft(np.exp(-1j * kx[:, None] * dt * v) * fft.fft(f, axis=0), axis=0)
+        return fft.irfft(
+            np.exp(-1j * kx_r[:, None] * dt * v)
+            * fft.rfft(f, axis=0, workers=fft_workers),
+            n=f.shape[0],
+            axis=0,
+            workers=fft_workers,
         )
 
     return step_vdfdx_exponential
 
 
-def get_edfdv_exponential(kv):
+def get_edfdv_exponential(kv, fft_workers=1):
     """
     This function creates the exponential v df/dx stepper
 
     It uses kv as metadata that should stay constant throughout the simulation
 
     :param kv: (float array (nv, )) the velocity-space wavenumber
+    :param fft_workers: (int) the number of threads used by the FFTs. -1 uses all the cores
     :return: a function with the above values initialized as static variables
     """
 
+    # f is real so only the non-negative wavenumbers are needed for the real-to-complex transforms
+    kv_r = kv[: kv.size // 2 + 1]
+
     def step_edfdv_exponential(f, e, dt):
         """
         evolution of df/dt = e df/dv using the exponential integrator described in
@@ -133,8 +145,12 @@ def get_edfdv_exponential(kv):
         :return: (float array (nx, nv)) updated distribution function
         """
 
-        return np.real(
-            fft.ifft(np.exp(-1j * kv * dt * e[:, None]) * fft.fft(f, axis=1), axis=1)
+        return fft.irfft(
+            np.exp(-1j * kv_r * dt * e[:, None])
+            * fft.rfft(f, axis=1, workers=fft_workers),
+            n=f.shape[1],
+            axis=1,
+            workers=fft_workers,
         )
 
     return step_edfdv_exponential
@@ -221,7 +237,9 @@ def get_vdfdx(stuff_for_time_loop, vdfdx_implementation="exponential"):
     """
     if vdfdx_implementation == "exponential":
         vdfdx = get_vdfdx_exponential(
-            kx=stuff_for_time_loop["kx"], v=stuff_for_time_loop["v"]
+            kx=stuff_for_time_loop["kx"],
+            v=stuff_for_time_loop["v"],
+            fft_workers=stuff_for_time_loop["fft_workers"],
         )
     elif vdfdx_implementation == "sl":
         vdfdx = get_vdfdx_sl(x=stuff_for_time_loop["x"], v=stuff_for_time_loop["v"])
@@ -245,7 +263,10 @@ def get_edfdv(stuff_for_time_loop, edfdv_implementation="exponential"):
     :return:
     """
     if edfdv_implementation == "exponential":
-        edfdv = get_edfdv_exponential(kv=stuff_for_time_loop["kv"])
+        edfdv = get_edfdv_exponential(
+            kv=stuff_for_time_loop["kv"],
+            fft_workers=stuff_for_time_loop["fft_workers"],
+        )
     elif edfdv_implementation == "cd2":
         edfdv = get_edfdv_center_differenced(dv=stuff_for_time_loop["dv"])
     elif edfdv_implementation == "sl":
@@ -21,45 +21,59 @@
 # SOFTWARE.
 
 
+def get_pulse_envelope(current_time, t_L, t_R, t_wL, t_wR, np):
+    """
+    This function returns the flat-top envelope of a pulse formed by two tanh ramps
+
+    :param current_time: (float or float array) the time(s) at which to evaluate the envelope
+    :param t_L: (float) the center of the rising edge
+    :param t_R: (float) the center of the falling edge
+    :param t_wL: (float) the width of the rising edge
+    :param t_wR: (float) the width of the falling edge
+    :param np: (NumPy) the numpy that is used to calculate the envelope
+    :return: (float or float array) the envelope, with the same shape as `current_time`
+    """
+    return 0.5 * (
+        np.tanh((current_time - t_L) / t_wL) - np.tanh((current_time - t_R) / t_wR)
+    )
+
+
 def get_driver_function(x, pulse_dictionary, np):
+    # The pulse parameters are read once here and stacked along a pulse axis
+    # so that all the pulses are evaluated together instead of in a Python loop
+    k0, w0, a0, t_L, t_R, t_wL, t_wR = (
+        np.array([pulse[key] for pulse in pulse_dictionary.values()], dtype=float)
+        for key in ["k0", "w0", "a0", "t_L", "t_R", "t_wL", "t_wR"]
+    )
+
+    # sin(kx - wt) = sin(kx) cos(wt) - cos(kx) sin(wt)
+    # so the spatial part of each pulse is only calculated once, here
+    sin_kx = (k0 * a0)[:, None] * np.sin(k0[:, None] * x)
+    cos_kx = (k0 * a0)[:, None] * np.cos(k0[:, None] * x)
+
     def driver_function(current_time):
-        total_field = np.zeros(x.size)
-
-        for this_pulse in list(pulse_dictionary.keys()):
-            kk = pulse_dictionary[this_pulse]["k0"]
-            ww = pulse_dictionary[this_pulse]["w0"]
-            t_L = pulse_dictionary[this_pulse]["t_L"]
-            t_R = pulse_dictionary[this_pulse]["t_R"]
-            t_wL = pulse_dictionary[this_pulse]["t_wL"]
-            t_wR = pulse_dictionary[this_pulse]["t_wR"]
-
-            envelope = 0.5 * (
-                np.tanh((current_time - t_L) / t_wL)
-                - np.tanh((current_time - t_R) / t_wR)
-            )
-
-            total_field += (
-                envelope
-                * kk
-                * pulse_dictionary[this_pulse]["a0"]
-                * np.sin(kk * x - ww * current_time)
-            )
-
-        return total_field
+        # `current_time` can be a scalar or a column of times, and the envelope gets a
+        # trailing pulse axis. The sum over the pulses is then a matrix product
+        envelope = get_pulse_envelope(current_time, t_L, t_R, t_wL, t_wR, np)
+        wt = w0 * current_time
+
+        return (envelope * np.cos(wt)) @ sin_kx - (envelope * np.sin(wt)) @ cos_kx
 
     return driver_function
 
 
-def make_driver_array(function, x_axis, time_axis):
+def make_driver_array(function, x_axis, time_axis, out=None):
     import numpy as np
 
-    driver_array = np.zeros(time_axis.shape + x_axis.shape)
-    for i in range(time_axis.size):
-        driver_array[
-            i,
-        ] = function(time_axis[i])
+    # A preallocated array can be provided so that it is reused for every batch
+    if out is None:
+        out = np.zeros(time_axis.shape + x_axis.shape)
+
+    # The driver function is evaluated over the whole time axis at once by passing
+    # it a column of times that broadcasts against the spatial grid
+    out[:] = function(time_axis[:, None])
 
-    return driver_array
+    return out
 
 
 def get_driver_array_using_function(x, t, pulse_dictionary, this_np):
@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from functools import lru_cache
+
 from mlflow.tracking import MlflowClient
 
 
@@ -29,3 +31,23 @@ def get_this_metric_of_this_run(metric_name, run_object):
 
     run = client.get_run(run_id)
     return run.data.metrics[metric_name]
+
+
+@lru_cache(maxsize=32)
+def get_experiment_id(exp_name, tracking_uri):
+    """
+    This function gets the id of an MLFlow experiment, creating the experiment if it does not exist.
+
+    The result is cached so that repeated runs, e.g. in a parameter sweep, only look up the experiment once.
+
+    :param exp_name: (string) the name of the MLFlow experiment
+    :param tracking_uri: (string) the MLFlow tracking URI the experiment lives on
+    :return: (string) the id of the experiment
+    """
+    client = MlflowClient(tracking_uri=tracking_uri)
+    experiment = client.get_experiment_by_name(exp_name)
+
+    if experiment is None:
+        return client.create_experiment(exp_name)
+
+    return experiment.experiment_id
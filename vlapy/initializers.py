@@ -19,6 +19,7 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+from functools import lru_cache
 
 import mlflow
 import numpy as np
@@ -26,6 +27,18 @@ import numpy as np
 from vlapy.diagnostics import z_function
 
 
+def __make_read_only__(*arrays):
+    """
+    The initializers are cached and hand back the same arrays to every caller.
+    This makes sure that none of those callers can modify them in-place.
+
+    :param arrays: (float arrays) the arrays to be shared
+    """
+    for array in arrays:
+        array.setflags(write=False)
+
+
+@lru_cache(maxsize=8)
 def initialize_distribution(nx, nv, vmax=6.0):
     """
     Initializes a Maxwell-Boltzmann distribution
@@ -49,10 +62,12 @@ def initialize_distribution(nx, nv, vmax=6.0):
 
     # normalize
     f = f / np.trapz(f, dx=dv, axis=1)[:, None]
+    __make_read_only__(f)
 
     return f
 
 
+@lru_cache(maxsize=8)
 def initialize_velocity_quantities(vmax, nv):
     """
     This function initializes the velocity grid and related quantities
@@ -65,10 +80,12 @@ def initialize_velocity_quantities(vmax, nv):
     dv = 2 * vmax / nv
     v = np.linspace(-vmax + dv / 2.0, vmax - dv / 2.0, nv)
     kv = np.fft.fftfreq(v.size, d=dv) * 2.0 * np.pi
+    __make_read_only__(v, kv)
 
     return dv, v, kv
 
 
+@lru_cache(maxsize=8)
 def initialize_spatial_quantities(xmin, xmax, nx):
     """
     This function initializes the spatial grid and related quantities
@@ -85,6 +102,7 @@ def initialize_spatial_quantities(xmin, xmax, nx):
     kx = np.fft.fftfreq(x.size, d=dx) * 2.0 * np.pi
     one_over_kx = np.zeros_like(kx)
     one_over_kx[1:] = 1.0 / kx[1:]
+    __make_read_only__(x, kx, one_over_kx)
 
     return dx, x, kx, one_over_kx
 
@@ -127,11 +145,12 @@ def make_default_params_dictionary():
         "xmin": 0.0,
         "nv": 512,
         "vmax": 6.4,
-        "nt": 500,
-        "tmax": 80,
+        # The run is exactly `nt` steps long, so this is the time window the diagnostics fit over
+        "nt": 800,
+        "tmax": 128,
         "fokker-planck": {
             "type": "lb",
-            "solver": "batched_tridiagonal",
+            "solver": "banded",
         },
         "vlasov-poisson": {
             "time": "leapfrog",
@@ -142,6 +161,7 @@ def make_default_params_dictionary():
         "backend": {
             "core": "numpy",
             "max_GB_for_device": int(1),
+            "fft_workers": 1,
         },
         "a0": 4e-7,
     }
@@ -22,14 +22,14 @@
 
 
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from tqdm import tqdm
 from time import time
 import mlflow
-import numpy as np
 
-from vlapy import storage, outer_loop
-from vlapy.infrastructure import print_to_screen
+from vlapy import storage, outer_loop, field_driver
+from vlapy.infrastructure import print_to_screen, mlflow_helpers
 
 
 def start_run(all_params, pulse_dictionary, diagnostics, uris, name="test"):
@@ -53,7 +53,7 @@ def start_run(all_params, pulse_dictionary, diagnostics, uris, name="test"):
     if "local" not in uris["tracking"].casefold():
         mlflow.set_tracking_uri(uris["tracking"])
 
-    exp_id = mlflow.set_experiment(name)
+    exp_id = mlflow_helpers.get_experiment_id(name, mlflow.get_tracking_uri())
 
     with mlflow.start_run(experiment_id=exp_id) as run:
         with tempfile.TemporaryDirectory() as temp_path:
@@ -72,10 +72,12 @@ def start_run(all_params, pulse_dictionary, diagnostics, uris, name="test"):
                 * all_params["backend"]["max_GB_for_device"]
                 / (6 * (mem_f_store + mem_field_store) * 8)
             )
-            if steps_in_loop > all_params["nt"]:
-                steps_in_loop = int(all_params["nt"] / 1.25)
+            if steps_in_loop >= all_params["nt"]:
+                steps_in_loop = all_params["nt"]
+                n_loops = 1
+            else:
+                n_loops = -(-all_params["nt"] // steps_in_loop)
 
-            n_loops = all_params["nt"] // steps_in_loop + 1
             actual_num_steps = n_loops * steps_in_loop
 
             all_params["steps_in_loop"] = steps_in_loop
@@ -91,7 +93,11 @@ def start_run(all_params, pulse_dictionary, diagnostics, uris, name="test"):
             )
 
             # Initialize the storage manager -- folders, parameters, etc.
-            storage_manager = storage.StorageManager(
+            # The upload happens on a background thread so that it overlaps with the next batch
+            #
+            # Leaving this block, even because of an error, waits for the upload to finish and
+            # then closes the files, before the temporary directory is removed
+            with storage.StorageManager(
                 xax=stuff_for_time_loop["x"],
                 vax=stuff_for_time_loop["v"],
                 f=stuff_for_time_loop["f"],
@@ -100,78 +106,124 @@ def start_run(all_params, pulse_dictionary, diagnostics, uris, name="test"):
                 num_steps_in_one_loop=steps_in_loop,
                 all_params=all_params,
                 pulse_dictionary=pulse_dictionary,
-            )
-
-            mlflow.log_metrics(metrics={"startup_time": time() - t0}, step=0)
-            t0 = time()
-
-            sim_config, do_inner_loop = outer_loop.get_sim_config_and_inner_loop_step(
-                all_params=all_params,
-                stuff_for_time_loop=stuff_for_time_loop,
-                nt_in_loop=steps_in_loop,
-                store_f_rules=diagnostics.rules_to_store_f,
-            )
-
-            mlflow.log_metrics(metrics={"compile_time": time() - t0}, step=0)
-            t0 = time()
-
-            # TODO: Could support resume here
-            it_start = 0
-
-            # We run a higher level loop and a lower level loop.
-            # The higher level loop contains:
-            # 1 - Get the driver for all time-steps involved in this iteration of the lower level loop
-            # 2 - Perform the lower level loop
-            # 3 - Write the output to file
-            #
-            # The lower level loop is a loop over `steps_in_loop` timesteps. It is entirely executed on the
-            # accelerator. The size of this loop can be controlled by the `MAX_DOUBLES_IN_FILE` parameter.
-            # The goal was to allow that parameter to control the amount of memory needed on the accelerator
-            for it in tqdm(range(it_start, n_loops * steps_in_loop, steps_in_loop)):
-                curr_time_index = np.arange(it, it + steps_in_loop)
-
-                # Get driver and time array for the duration of the lower level loop
-                driver_array = np.array(stuff_for_time_loop["driver"][curr_time_index])
-                time_array = np.array(stuff_for_time_loop["t"][curr_time_index])
-
-                # Perform lower level loop
-                sim_config = do_inner_loop(
-                    temp_storage=sim_config,
-                    driver_array=driver_array,
-                    time_array=time_array,
-                )
-
-                mlflow.log_metrics(
-                    metrics={"calculation_time": (time() - t0) / steps_in_loop}, step=it
-                )
+            ) as storage_manager, ThreadPoolExecutor(max_workers=1) as uploader:
+                mlflow.log_metrics(metrics={"startup_time": time() - t0}, step=0)
                 t0 = time()
 
-                # Perform a batched data update with the lower level loop output
-                storage_manager.batch_update(sim_config)
-
-                mlflow.log_metrics(metrics={"batch_update_time": time() - t0}, step=it)
-                t0 = time()
-
-                # Run the diagnostics on the simulation so far
-                diagnostics(storage_manager)
-
-                mlflow.log_metrics(metrics={"diagnostic_time": time() - t0}, step=it)
-                mlflow.log_metrics(
-                    metrics={
-                        "diagnostic_time_averaged_over_sim_time": (time() - t0)
-                        / ((it + 1) * steps_in_loop)
-                    },
-                    step=it,
+                sim_config, do_inner_loop = (
+                    outer_loop.get_sim_config_and_inner_loop_step(
+                        all_params=all_params,
+                        stuff_for_time_loop=stuff_for_time_loop,
+                        nt_in_loop=steps_in_loop,
+                        store_f_rules=diagnostics.rules_to_store_f,
+                    )
                 )
-                t0 = time()
 
-                # Log the artifacts
-                storage_manager.log_artifacts()
-
-                mlflow.log_metrics(metrics={"logging_time": time() - t0}, step=it)
+                mlflow.log_metrics(metrics={"compile_time": time() - t0}, step=0)
                 t0 = time()
 
-            storage_manager.close()
-            del storage_manager
+                # TODO: Could support resume here
+                it_start = 0
+
+                # Running totals for the time-averaged diagnostic cost
+                total_diagnostic_time = 0.0
+                total_sim_steps = 0
+
+                # Uploading the artifacts is I/O bound so it is only done every few batches and at the end
+                artifact_logging_interval = max(1, n_loops // 10)
+
+                pending_upload = None
+
+                # We run a higher level loop and a lower level loop.
+                # The higher level loop contains:
+                # 1 - Get the driver for all time-steps involved in this iteration of the lower level loop
+                # 2 - Perform the lower level loop
+                # 3 - Write the output to file
+                #
+                # The lower level loop is a loop over `steps_in_loop` timesteps. It is entirely executed on the
+                # accelerator. The size of this loop can be controlled by the `MAX_DOUBLES_IN_FILE` parameter.
+                # The goal was to allow that parameter to control the amount of memory needed on the accelerator
+                for it in tqdm(range(it_start, actual_num_steps, steps_in_loop)):
+                    curr_time_slice = slice(it, it + steps_in_loop)
+
+                    # Get driver and time array for the duration of the lower level loop
+                    # The time array is a view. The driver is only calculated for this batch
+                    # and is written into the buffer that is allocated once for all batches
+                    time_array = stuff_for_time_loop["t"][curr_time_slice]
+                    driver_array = field_driver.make_driver_array(
+                        function=stuff_for_time_loop["driver_function"],
+                        x_axis=stuff_for_time_loop["x"],
+                        time_axis=time_array,
+                        out=sim_config["driver_array_batch"],
+                    )
+
+                    # Perform lower level loop
+                    sim_config = do_inner_loop(
+                        temp_storage=sim_config,
+                        driver_array=driver_array,
+                        time_array=time_array,
+                    )
+
+                    mlflow.log_metrics(
+                        metrics={"calculation_time": (time() - t0) / steps_in_loop},
+                        step=it,
+                    )
+
+                    # The batch is written into the files that are being uploaded
+                    # so the previous upload needs to have finished first
+                    if pending_upload is not None:
+                        pending_upload.result()
+                        pending_upload = None
+                    t0 = time()
+
+                    # Perform a batched data update with the lower level loop output
+                    storage_manager.batch_update(sim_config)
+
+                    mlflow.log_metrics(
+                        metrics={"batch_update_time": time() - t0}, step=it
+                    )
+                    t0 = time()
+
+                    # Run the diagnostics on the simulation so far
+                    diagnostics(storage_manager)
+
+                    diagnostic_time = time() - t0
+                    total_diagnostic_time += diagnostic_time
+                    total_sim_steps += steps_in_loop
+
+                    mlflow.log_metrics(
+                        metrics={"diagnostic_time": diagnostic_time}, step=it
+                    )
+                    mlflow.log_metrics(
+                        metrics={
+                            "diagnostic_time_averaged_over_sim_time": total_diagnostic_time
+                            / total_sim_steps
+                        },
+                        step=it,
+                    )
+                    t0 = time()
+
+                    # Log the artifacts. The files were flushed to disk at the end of `batch_update`
+                    # so the upload sees complete files. The last upload is done once the files are closed
+                    batch_number = it // steps_in_loop + 1
+                    if (
+                        batch_number % artifact_logging_interval == 0
+                        and batch_number < n_loops
+                    ):
+                        pending_upload = uploader.submit(
+                            storage_manager.log_artifacts, run_id=run.info.run_id
+                        )
+
+                    mlflow.log_metrics(metrics={"logging_time": time() - t0}, step=it)
+                    t0 = time()
+
+                # Wait for the last upload so that any error in it is raised here
+                if pending_upload is not None:
+                    pending_upload.result()
+
+            # The final version of the files is uploaded after they have been closed
+            t0 = time()
+            storage_manager.log_artifacts()
+            mlflow.log_metrics(metrics={"final_logging_time": time() - t0}, step=0)
 
     return run
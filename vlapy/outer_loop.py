@@ -22,11 +22,32 @@
 
 
 from time import time
-from tqdm import tqdm
 
 from vlapy import initializers, field_driver
 from vlapy.core import step
 
+# The quantities stored at every time-step in the inner loop
+FIELD_NAMES = ("e", "driver", "n", "j", "T", "q", "fv4", "vN")
+SERIES_NAMES = (
+    "mean_n",
+    "mean_j",
+    "mean_T",
+    "mean_e2",
+    "mean_de2",
+    "mean_f2",
+    "mean_flogf",
+    # These are calculated from the others at the end of the inner loop
+    "mean_cum_de2",
+    "mean_t_plus_e2_minus_cum_de2",
+    "mean_t_plus_e2_plus_cum_de2",
+)
+# The (real, complex) types used to stage the distribution function for each
+# choice of the optional `precision` rule for storing f
+STORE_F_DTYPES = {
+    "single": ("float32", "complex64"),
+    "double": ("float64", "complex128"),
+}
+
 
 def get_sim_config_and_inner_loop_step(
     all_params,
@@ -76,7 +97,7 @@ def get_everything_ready_for_outer_loop(
     velocity grid
     distribution function
     time grid
-    driver array
+    driver function
 
     :param diagnostics: (vlapy.Diagnostics) Object describing the diagnostics and analysis used for this simulation
     :param all_params: (dictionary) contains the input parameters for the simulation
@@ -118,9 +139,8 @@ def get_everything_ready_for_outer_loop(
         x=x, pulse_dictionary=pulse_dictionary, np=np
     )
 
-    driver_array = field_driver.make_driver_array(
-        function=driver_function, x_axis=x, time_axis=t
-    )
+    # The driver array is not made here. It is made one batch at a time in the
+    # outer loop so that the whole (nt, nx) array is never held in memory
 
     everything_for_time_loop = {
         "e": np.zeros(x.size),
@@ -133,12 +153,12 @@ def get_everything_ready_for_outer_loop(
         "kv": kv,
         "nv": all_params["nv"],
         "dv": dv,
-        "driver": driver_array,
         "driver_function": driver_function,
         "dt": dt,
         "nu": all_params["nu"],
         "t": t,
         "rules_to_store_f": diagnostics.rules_to_store_f,
+        "fft_workers": all_params["backend"]["fft_workers"],
         "vlasov-poisson": all_params["vlasov-poisson"],
         "fokker-planck": all_params["fokker-planck"],
     }
@@ -158,11 +178,23 @@ def get_arrays_for_inner_loop(stuff_for_time_loop, nt_in_loop, store_f_rules, th
     """
     import numpy as np
 
+    # Single precision is enough for the stored Fourier modes and halves the memory
+    # and the bytes written to file. In real space, f is close to a Maxwellian and
+    # single precision would round away perturbations of ~1e-7, so double precision
+    # is the default there. Either can be chosen with the `precision` rule
+    default_precision = "double" if store_f_rules["space"] == "all" else "single"
+    precision = store_f_rules.get("precision", default_precision)
+    if precision not in STORE_F_DTYPES:
+        raise NotImplementedError(
+            "Storing f in <" + str(precision) + "> precision is not supported"
+        )
+    real_dtype, complex_dtype = STORE_F_DTYPES[precision]
+
     # This is where we initialize the right distribution function storage array
     # If we're saving all the "x" values then that array is created
     if store_f_rules["space"] == "all":
         store_f = np.zeros(
-            (nt_in_loop,) + stuff_for_time_loop["f"].shape, dtype=np.float64
+            (nt_in_loop,) + stuff_for_time_loop["f"].shape, dtype=real_dtype
         )
         store_f[
             0,
@@ -176,42 +208,40 @@ def get_arrays_for_inner_loop(stuff_for_time_loop, nt_in_loop, store_f_rules, th
                 len(store_f_rules["space"]),
                 stuff_for_time_loop["f"].shape[1],
             ),
-            dtype=np.complex64,
+            dtype=complex_dtype,
         )
 
-        store_f[0,] = np.fft.fft(
-            stuff_for_time_loop["f"], axis=0
-        )[: len(store_f_rules["space"])]
+        store_f[0,] = np.fft.rfft(stuff_for_time_loop["f"], axis=0)[
+            : len(store_f_rules["space"])
+        ].astype(complex_dtype, copy=False)
 
     else:
         raise NotImplementedError
 
+    # All the fields and all the series are each stored in one contiguous buffer
+    # that is allocated and zeroed in one go. The dictionaries hold views into these buffers
+    # so that they can still be accessed by name
+    #
+    # These stay in double precision. Quantities like the density and temperature are O(1)
+    # and carry perturbations that single precision would round away
+    fields_array = this_np.zeros(
+        (len(FIELD_NAMES), nt_in_loop) + stuff_for_time_loop["e"].shape
+    )
+    series_array = this_np.zeros((len(SERIES_NAMES), nt_in_loop))
+
     # This is where we return the whole simulation configuration dictionary
     return {
         "time_batch": this_np.zeros(nt_in_loop),
+        "driver_array_batch": this_np.zeros(
+            (nt_in_loop,) + stuff_for_time_loop["e"].shape
+        ),
         "e": this_np.array(stuff_for_time_loop["e"]),
         "f": this_np.array(stuff_for_time_loop["f"]),
-        "stored_f": this_np.array(store_f),
+        # `store_f` is freshly allocated above so it is used as-is rather than copied
+        "stored_f": store_f,
         "mean_cum_de2_previous": 0.0,
-        "series": {
-            "mean_n": this_np.zeros(nt_in_loop),
-            "mean_j": this_np.zeros(nt_in_loop),
-            "mean_T": this_np.zeros(nt_in_loop),
-            "mean_e2": this_np.zeros(nt_in_loop),
-            "mean_de2": this_np.zeros(nt_in_loop),
-            "mean_f2": this_np.zeros(nt_in_loop),
-            "mean_flogf": this_np.zeros(nt_in_loop),
-        },
-        "fields": {
-            "e": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-            "driver": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-            "n": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-            "j": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-            "T": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-            "q": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-            "fv4": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-            "vN": this_np.zeros((nt_in_loop,) + stuff_for_time_loop["e"].shape),
-        },
+        "series": {name: series_array[idx] for idx, name in enumerate(SERIES_NAMES)},
+        "fields": {name: fields_array[idx] for idx, name in enumerate(FIELD_NAMES)},
     }
 
 
@@ -224,23 +254,29 @@ def post_inner_loop_update(temp_storage, this_np):
     :return:
     """
 
+    series = temp_storage["series"]
+
+    # The results are written into the slots that are preallocated in the series buffer
+    # so that no temporary arrays are created
+
     # Energy from driver
-    temp_storage["series"]["mean_cum_de2"] = temp_storage[
-        "mean_cum_de2_previous"
-    ] + this_np.cumsum(temp_storage["series"]["mean_de2"])
+    this_np.cumsum(series["mean_de2"], out=series["mean_cum_de2"])
+    series["mean_cum_de2"] += temp_storage["mean_cum_de2_previous"]
 
     # See if E_driver = E_f + E_e
-    temp_storage["series"]["mean_t_plus_e2_minus_cum_de2"] = temp_storage["series"][
-        "mean_T"
-    ] + (temp_storage["series"]["mean_e2"] - temp_storage["series"]["mean_cum_de2"])
-
-    temp_storage["series"]["mean_t_plus_e2_plus_cum_de2"] = (
-        temp_storage["series"]["mean_T"]
-        + temp_storage["series"]["mean_e2"]
-        + temp_storage["series"]["mean_de2"]
+    this_np.subtract(
+        series["mean_e2"],
+        series["mean_cum_de2"],
+        out=series["mean_t_plus_e2_minus_cum_de2"],
+    )
+    series["mean_t_plus_e2_minus_cum_de2"] += series["mean_T"]
+
+    this_np.add(
+        series["mean_T"], series["mean_e2"], out=series["mean_t_plus_e2_plus_cum_de2"]
     )
+    series["mean_t_plus_e2_plus_cum_de2"] += series["mean_de2"]
 
-    temp_storage["mean_cum_de2_previous"] = temp_storage["series"]["mean_cum_de2"][-1]
+    temp_storage["mean_cum_de2_previous"] = series["mean_cum_de2"][-1]
 
     return temp_storage
 
@@ -265,7 +301,8 @@ def get_inner_loop_stepper(all_params, stuff_for_time_loop, steps_in_loop):
         def inner_loop(time_array, driver_array, temp_storage):
             temp_storage["time_batch"] = time_array
             temp_storage["driver_array_batch"] = driver_array
-            for it in tqdm(range(steps_in_loop)):
+            # Progress is reported once per batch by the outer loop, not at every step
+            for it in range(steps_in_loop):
                 temp_storage, _ = one_step(temp_storage, it)
             post_inner_loop_update(temp_storage, np)
 
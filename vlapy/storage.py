@@ -22,57 +22,170 @@
 
 import os
 import json
-import shutil
 
+import h5netcdf
+import h5py
 import mlflow
+from mlflow.tracking import MlflowClient
 import xarray as xr
+from xarray.core import indexing
 import numpy as np
 
+# The target size of an HDF5 chunk in bytes
+CHUNK_SIZE_IN_BYTES = 20e6
 
-def combine_and_save_dataset(individual_path, overall_path):
+# The distribution function dominates the size of the output. It varies smoothly so it
+# compresses well, especially after the bytes are shuffled. The fastest gzip level is
+# used so that the compression does not slow down the writes
+DISTRIBUTION_COMPRESSION = {
+    "compression": "gzip",
+    "compression_opts": 1,
+    "shuffle": True,
+}
+
+
+def get_chunk_shape(batch_shape, itemsize):
     """
-    This function
-    1 - loads multiple dataarrays
-    2 - concatenates them into one dataset
-    3 - writes to file
+    This function returns the shape of the HDF5 chunks for a variable that is written a batch at a time.
 
-    :param individual_path: (string) path to the folder containing the data from each batch
-    :param overall_path: (string) path to the folder containing the combined data
+    A whole batch is one chunk unless that is larger than `CHUNK_SIZE_IN_BYTES`. In that case, the time axis of
+    the chunk is the largest divisor of the batch length that fits, so that a batch still starts and ends on a chunk
+    boundary and no chunk is ever partially rewritten.
+
+    :param batch_shape: (tuple) the shape of one batch, with time as the first axis
+    :param itemsize: (int) the size of one element in bytes
+    :return: (tuple) the shape of the chunks
     """
-    arr = xr.open_mfdataset(
-        individual_path,
-        combine="by_coords",
-        engine="h5netcdf",
-        parallel=True,
+    num_steps = batch_shape[0]
+    bytes_per_step = itemsize * int(np.prod(batch_shape[1:]))
+    max_steps = max(1, int(CHUNK_SIZE_IN_BYTES // bytes_per_step))
+
+    steps_in_chunk = max(
+        steps
+        for steps in range(1, min(num_steps, max_steps) + 1)
+        if num_steps % steps == 0
     )
 
-    arr.to_netcdf(
-        overall_path,
-        engine="h5netcdf",
-        invalid_netcdf=True,
-    )
+    return (steps_in_chunk,) + tuple(batch_shape[1:])
 
-    del arr
 
+def create_file(h5_file, coords):
+    """
+    This function creates a file that the batches are appended to along the time axis
 
-def combine_save_and_open_dataset(individual_path, overall_path):
+    :param h5_file: (h5py.File) the new HDF5 file, open for writing, that the netCDF file is written to
+    :param coords: (list of tuples) the (name, values) of each of the non-time coordinates
+    :return: (h5netcdf.File) the open file
     """
-    This function combines the datasets created per batch along the time axis.
-    Then it saves the newly combined dataset and deletes the reference to free up memory.
+    fi = h5netcdf.File(h5_file, "w")
+
+    # The time dimension is unlimited so that it can grow with every batch
+    fi.dimensions = {"time": None}
+    fi.dimensions.update({name: values.size for name, values in coords})
+
+    fi.create_variable("time", ("time",), dtype=np.float64)
+    for name, values in coords:
+        fi.create_variable(name, (name,), data=values)
+
+    return fi
 
-    Then it lazy loads the newly combined dataset
 
-    :param individual_path: (string) path to the folder containing the data from each batch
-    :param overall_path: (string) path to the folder containing the combined data
-    :return: (xArray Dataset) lazy loaded xarray dataset
+def write_batch_to_file(
+    fi, dims, dict_of_stored_data, time_actually_stored, time_slice, compression=None
+):
     """
-    combine_and_save_dataset(individual_path, overall_path)
-    arr = xr.open_dataset(
-        overall_path,
-        engine="h5netcdf",
-    )
+    This function writes a batch of data into a slice of the time axis of an open file.
+
+    Only the new batch is written. The file grows if the slice is past the end of it.
+    Nothing is flushed to disk here, see `StorageManager.flush`
+
+    :param fi: (h5netcdf.File) the file made by `create_file`
+    :param dims: (tuple) the names of the dimensions of the arrays, starting with "time"
+    :param dict_of_stored_data: (dictionary) the arrays, with time as the first axis, to be written
+    :param time_actually_stored: (float array) the time axis of the batch
+    :param time_slice: (slice) the positions along the time axis of the file that the batch is written to
+    :param compression: (dictionary) the HDF5 filter settings used when a variable is created, e.g.
+    `DISTRIBUTION_COMPRESSION`. Nothing is compressed if this is not provided
+    """
+    if compression is None:
+        compression = {}
+
+    if fi.dimensions["time"].size < time_slice.stop:
+        fi.resize_dimension("time", time_slice.stop)
+
+    fi.variables["time"][time_slice] = time_actually_stored
+
+    for name, array in dict_of_stored_data.items():
+        variable_dims = dims
+
+        # netCDF has no complex type so the real and imaginary parts are stored along a trailing axis.
+        # This is a view so nothing is copied. `get_dataset_with_complex_variables` undoes it
+        if np.iscomplexobj(array):
+            array = array.view(array.real.dtype).reshape(array.shape + (2,))
+            variable_dims = dims + ("real_imag",)
+
+        if name not in fi.variables:
+            if "real_imag" in variable_dims and "real_imag" not in fi.dimensions:
+                fi.dimensions["real_imag"] = 2
+
+            # The chunks line up with the batches so each write only touches whole chunks
+            fi.create_variable(
+                name,
+                variable_dims,
+                dtype=array.dtype,
+                chunks=get_chunk_shape(array.shape, array.dtype.itemsize),
+                **compression,
+            )
+        fi.variables[name][time_slice] = array
+
 
-    return arr
+class ComplexFromRealImagArray(xr.backends.BackendArray):
+    """
+    This wraps a lazily loaded variable that holds real and imaginary parts along its trailing
+    `real_imag` axis so that it reads as a complex array without the `real_imag` axis.
+
+    Nothing is read when this is made. Only the part that is indexed is read and put back together.
+    """
+
+    def __init__(self, variable):
+        """
+        :param variable: (xArray Variable) the variable as it was read from the file
+        """
+        self.variable = variable
+        self.shape = variable.shape[:-1]
+        self.dtype = np.result_type(variable.dtype, np.complex64)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.BASIC, self.__read__
+        )
+
+    def __read__(self, key):
+        parts = self.variable[key + (slice(None),)].values
+        return np.ascontiguousarray(parts).view(self.dtype)[..., 0]
+
+
+def get_dataset_with_complex_variables(dataset):
+    """
+    This function puts back together the complex variables that were written as
+    real and imaginary parts by `write_batch_to_file`
+
+    The variables stay lazy and are only read when they are indexed
+
+    :param dataset: (xArray Dataset) the dataset as it was read from the file
+    :return: (xArray Dataset) the dataset with complex variables
+    """
+    for name, data_array in dataset.data_vars.items():
+        if "real_imag" in data_array.dims:
+            dataset[name] = xr.Variable(
+                data_array.dims[:-1],
+                indexing.LazilyIndexedArray(
+                    ComplexFromRealImagArray(data_array.variable)
+                ),
+                attrs=data_array.attrs,
+            )
+
+    return dataset
 
 
 def get_batched_data_from_sim_config(sim_config):
@@ -98,26 +211,19 @@ def get_paths(base_path):
     :param base_path:
     :return:
     """
+    long_term = os.path.join(base_path, "long_term")
     paths = {
         "base": base_path,
-        "long_term": os.path.join(base_path, "long_term"),
-        "temp": os.path.join(base_path, "temp"),
-        "series": os.path.join(base_path, "long_term", "series"),
-        "fields": os.path.join(base_path, "long_term", "fields"),
-        "distribution": os.path.join(base_path, "long_term", "distribution_function"),
-        "full_distribution": os.path.join(base_path, "long_term", "full_distribution"),
-        "series-individual": os.path.join(base_path, "temp", "series"),
-        "fields-individual": os.path.join(base_path, "temp", "fields"),
-        "distribution-individual": os.path.join(
-            base_path, "temp", "distribution_function"
-        ),
-        "full_distribution-individual": os.path.join(
-            base_path, "temp", "full_distribution_function"
-        ),
+        "long_term": long_term,
+        "series": os.path.join(long_term, "series"),
+        "fields": os.path.join(long_term, "fields"),
+        "distribution": os.path.join(long_term, "distribution_function"),
+        "full_distribution": os.path.join(long_term, "full_distribution"),
     }
 
-    for key, val in paths.items():
-        os.makedirs(val, exist_ok=True)
+    # Making the innermost folders also makes their parents
+    for key in ["series", "fields", "distribution", "full_distribution"]:
+        os.makedirs(paths[key], exist_ok=True)
 
     return paths
 
@@ -164,15 +270,121 @@ class StorageManager:
         self.write_parameters_to_file(all_params, "all_parameters")
         self.write_parameters_to_file(pulse_dictionary, "pulses")
 
+        self.file_names = {
+            "series": os.path.join(self.paths["series"], "all-series.nc"),
+            "fields": os.path.join(self.paths["fields"], "all-fields.nc"),
+            "distribution": os.path.join(
+                self.paths["distribution"], "all-distribution.nc"
+            ),
+            "full_distribution": os.path.join(
+                self.paths["full_distribution"], "all-full_distribution.nc"
+            ),
+        }
+
+        # The rules for storing the distribution function are resolved once, here
+        f_space_coord = self.__get_f_space_coord__()
+        self.get_f_slice = self.__get_f_slice_getter__()
+
+        # The non-time coordinates of each file
+        coords = {
+            "series": [],
+            "fields": [("space", self.xax)],
+            "distribution": [f_space_coord, ("velocity", self.vax)],
+            "full_distribution": [("space", self.xax), ("velocity", self.vax)],
+        }
+
+        # The files are opened once and every batch is appended to them
+        # The HDF5 files are held here, and not only by h5netcdf, so that they can be flushed to disk
+        self.h5_files = {
+            key: h5py.File(self.file_names[key], "w", track_order=True)
+            for key in coords
+        }
+        self.files = {
+            key: create_file(self.h5_files[key], coords=coords_of_file)
+            for key, coords_of_file in coords.items()
+        }
+        self.dims = {
+            key: ("time",) + tuple(name for name, _ in coords_of_file)
+            for key, coords_of_file in coords.items()
+        }
+
+    def __get_f_slice_getter__(self):
+        """
+        This method picks the function that returns the slice of the time axis
+        the stored distribution function is written to. The choice is made once here.
+
+        :return: (function) returns the slice for the current batch
+        """
+        if self.rules_to_store_f["time"] == "first-last":
+
+            last_slice = slice(
+                self.num_timesteps_to_store, 2 * self.num_timesteps_to_store
+            )
+
+            # The first batch is kept and every later batch overwrites the one after it
+            def get_f_slice():
+                return self.batch_slice if self.stored == 0 else last_slice
+
+        elif self.rules_to_store_f["time"] == "all":
+
+            def get_f_slice():
+                return self.batch_slice
+
+        else:
+            raise NotImplementedError
+
+        return get_f_slice
+
+    def __get_f_space_coord__(self):
+        """
+        This method returns the spatial coordinate of the stored distribution function
+
+        :return: (tuple) the name and values of the coordinate
+        """
+        if not isinstance(self.rules_to_store_f, dict):
+            raise NotImplementedError
+
+        if self.rules_to_store_f["space"] == "all":
+            return "space", self.xax
+
+        elif self.rules_to_store_f["space"][0] == "k0":
+            return "fourier_mode", np.arange(len(self.rules_to_store_f["space"]))
+        else:
+            raise NotImplementedError
+
     def close(self):
         """
-        This method removes the temporary directories and files
+        This method closes the files
+
+        :return:
+        """
+
+        for key, fi in self.files.items():
+            fi.close()
+            self.h5_files[key].close()
+
+    def flush(self):
+        """
+        This method writes everything written so far to disk so that the files can be read, or copied,
+        from outside this StorageManager. Flushing the h5netcdf files alone does not flush HDF5
 
         :return:
         """
 
-        shutil.rmtree(self.paths["distribution-individual"])
-        shutil.rmtree(self.paths["fields-individual"])
+        for key, fi in self.files.items():
+            fi.flush()
+            self.h5_files[key].flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """
+        The files are closed when the `with` block is left, even if it is because of an error
+
+        :return:
+        """
+        self.close()
 
     def batch_update(self, sim_config):
         """
@@ -192,6 +404,12 @@ class StorageManager:
             self.current_f,
         ) = get_batched_data_from_sim_config(sim_config)
 
+        # The slice of the time axis this batch is written to
+        self.batch_slice = slice(
+            self.stored * self.num_timesteps_to_store,
+            (self.stored + 1) * self.num_timesteps_to_store,
+        )
+
         self.write_dist(time_actually_stored=time_actually_stored[-1:])
 
         self.write_series_batch(
@@ -206,6 +424,7 @@ class StorageManager:
             time_actually_stored=time_actually_stored,
             dict_of_stored_dist=dict_of_stored_dists,
         )
+        self.flush()
         self.stored += 1
 
     def write_dist(self, time_actually_stored):
@@ -216,18 +435,13 @@ class StorageManager:
         :return:
         """
 
-        df_coords = [
-            ("time", time_actually_stored),
-            ("space", self.xax),
-            ("velocity", self.vax),
-        ]
-        self.__write_batch__(
+        write_batch_to_file(
+            self.files["full_distribution"],
+            self.dims["full_distribution"],
             {"full_distribution": np.expand_dims(self.current_f, axis=0)},
-            coords=df_coords,
-            individual_file_name=os.path.join(
-                self.paths["full_distribution-individual"],
-                format(self.stored, "03") + ".nc",
-            ),
+            time_actually_stored=time_actually_stored,
+            time_slice=slice(self.stored, self.stored + 1),
+            compression=DISTRIBUTION_COMPRESSION,
         )
 
     def write_field_batch(self, time_actually_stored, dict_of_stored_fields):
@@ -239,13 +453,12 @@ class StorageManager:
         :return:
         """
 
-        field_coords = [("time", time_actually_stored), ("space", self.xax)]
-        self.__write_batch__(
+        write_batch_to_file(
+            self.files["fields"],
+            self.dims["fields"],
             dict_of_stored_fields,
-            coords=field_coords,
-            individual_file_name=os.path.join(
-                self.paths["fields-individual"], format(self.stored, "03") + ".nc"
-            ),
+            time_actually_stored=time_actually_stored,
+            time_slice=self.batch_slice,
         )
 
     def write_series_batch(self, time_actually_stored, dict_of_stored_series):
@@ -257,86 +470,25 @@ class StorageManager:
         :return:
         """
 
-        series_coords = [("time", time_actually_stored)]
-        self.__write_batch__(
+        write_batch_to_file(
+            self.files["series"],
+            self.dims["series"],
             dict_of_stored_series,
-            coords=series_coords,
-            individual_file_name=os.path.join(
-                self.paths["series-individual"], format(self.stored, "03") + ".nc"
-            ),
+            time_actually_stored=time_actually_stored,
+            time_slice=self.batch_slice,
         )
 
     def write_dist_batch(self, time_actually_stored, dict_of_stored_dist):
 
-        if not isinstance(self.rules_to_store_f, dict):
-            raise NotImplementedError
-
-        f_coords = [
-            ("time", time_actually_stored),
-            (None, None),
-            ("velocity", self.vax),
-        ]
-
-        if self.rules_to_store_f["space"] == "all":
-            f_coords[1] = ("space", self.xax)
-
-        elif self.rules_to_store_f["space"][0] == "k0":
-            f_coords[1] = (
-                "fourier_mode",
-                np.linspace(
-                    0,
-                    len(self.rules_to_store_f["space"]) - 1,
-                    len(self.rules_to_store_f["space"]),
-                ),
-            )
-        else:
-            raise NotImplementedError
-
-        if self.rules_to_store_f["time"] == "first-last":
-            if self.stored == 0:
-                self.f_store_index = 0
-            else:
-                self.f_store_index = 999
-        elif self.rules_to_store_f["time"] == "all":
-            if self.stored == 0:
-                self.f_store_index = 0
-            else:
-                self.f_store_index += 1
-        else:
-            raise NotImplementedError
-
-        self.__write_batch__(
+        write_batch_to_file(
+            self.files["distribution"],
+            self.dims["distribution"],
             dict_of_stored_dist,
-            coords=f_coords,
-            individual_file_name=os.path.join(
-                self.paths["distribution-individual"],
-                format(self.f_store_index, "03") + ".nc",
-            ),
+            time_actually_stored=time_actually_stored,
+            time_slice=self.get_f_slice(),
+            compression=DISTRIBUTION_COMPRESSION,
         )
 
-    def __write_batch__(self, dict_of_stored_data, coords, individual_file_name):
-        """
-        This writes a batch of 1D arrays to file
-
-        :param time_actually_stored:
-        :param dict_of_stored_fields:
-        :return:
-        """
-
-        dataarray_dict = {}
-
-        for name, array in dict_of_stored_data.items():
-            dataarray_dict[name] = xr.DataArray(
-                data=array,
-                coords=coords,
-            )
-
-        ds = xr.Dataset(data_vars=dataarray_dict)
-
-        # Save
-        ds.to_netcdf(individual_file_name, engine="h5netcdf")
-        del ds
-
     def write_parameters_to_file(self, param_dict, filename):
         """
         This is a helper function in case anything else needs to be written to file
@@ -346,40 +498,39 @@ class StorageManager:
         :return:
         """
         with open(os.path.join(self.paths["base"], filename + ".txt"), "w") as fi:
-            json.dump(param_dict, fi)
+            # `json.dumps` uses the C encoder, unlike `json.dump`, and the result is written in one go
+            fi.write(json.dumps(param_dict))
 
     def load_data_over_all_timesteps(self):
         """
+        This lazy loads the data written so far. The batches are already in one file each
+        so nothing needs to be combined.
 
         :return:
         """
 
-        combine_and_save_dataset(
-            individual_path=self.paths["full_distribution-individual"] + "/*.nc",
-            overall_path=os.path.join(
-                self.paths["full_distribution"], "all-full_distribution.nc"
-            ),
+        self.series_dataset = xr.open_dataset(
+            self.file_names["series"], engine="h5netcdf"
         )
-
-        self.series_dataset = combine_save_and_open_dataset(
-            individual_path=self.paths["series-individual"] + "/*.nc",
-            overall_path=os.path.join(self.paths["series"], "all-series.nc"),
+        self.fields_dataset = xr.open_dataset(
+            self.file_names["fields"], engine="h5netcdf"
         )
-
-        self.fields_dataset = combine_save_and_open_dataset(
-            individual_path=self.paths["fields-individual"] + "/*.nc",
-            overall_path=os.path.join(self.paths["fields"], "all-fields.nc"),
+        self.dist_dataset = get_dataset_with_complex_variables(
+            xr.open_dataset(self.file_names["distribution"], engine="h5netcdf")
         )
 
-        self.dist_dataset = combine_save_and_open_dataset(
-            individual_path=self.paths["distribution-individual"] + "/*.nc",
-            overall_path=os.path.join(
-                self.paths["distribution"], "all-distribution.nc"
-            ),
-        )
+    def log_artifacts(self, run_id=None):
+        """
+        This uploads the long term storage folder to MLFlow
 
-    def log_artifacts(self):
-        mlflow.log_artifacts(self.paths["long_term"])
+        :param run_id: (string) the id of the run to log to. This is needed when the upload is not done from the
+        thread that started the run. If None, the active run is used.
+        :return:
+        """
+        if run_id is None:
+            mlflow.log_artifacts(self.paths["long_term"])
+        else:
+            MlflowClient().log_artifacts(run_id, self.paths["long_term"])
 
     def unload_data_over_all_timesteps(self):
         del self.series_dataset